@@ -1,7 +1,13 @@
+# Засекаем время до импорта сторонних библиотек, чтобы отчет о старте учитывал и их загрузку
+import time
+started_at = time.perf_counter()
+
 import asyncio
 import logging
 import json
 import sys
+import os
+from contextlib import contextmanager
 from datetime import date
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode
@@ -10,12 +16,13 @@ from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, C
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from config import BOT_TOKEN
+from config import BOT_TOKEN, SHUTDOWN_DRAIN_TIMEOUT, READY_FILE
 from database import (
     insert_user, get_user_by_telegram_id, save_onboarding_data, 
     get_full_user_profile, save_generated_plan
 )
-from llm import generate_structured_plan_with_llm
+from llm import generate_structured_plan_with_llm, close_llm_client
+from history import get_training_history
 
 # Включаем логирование
 logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -58,6 +65,19 @@ storage = MemoryStorage()
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher(storage=storage)
 
+# --- Генерации в процессе (для мягкой остановки) ---
+inflight_tasks: set = set()
+
+@contextmanager
+def track_inflight():
+    """Помечает текущую задачу как незавершенную генерацию, которую нужно дождаться при остановке."""
+    task = asyncio.current_task()
+    inflight_tasks.add(task)
+    try:
+        yield
+    finally:
+        inflight_tasks.discard(task)
+
 # --- Словарь с вопросами для навигации "Назад" ---
 QUESTIONS_MAP = {
     "waiting_for_name": ("Давай знакомиться. Я уже представился, а как тебя зовут?", OnboardingState.waiting_for_name, None),
@@ -83,13 +103,15 @@ QUESTIONS_MAP = {
 }
 
 # --- Промпты и Форматирование ---
-def format_prompt_for_detailed_json(profile_data: dict, week_num: int = 1) -> str:
+def format_prompt_for_detailed_json(profile_data: dict, week_num: int = 1, history_context: str = "") -> str:
     profile = profile_data.get('profile', {})
     preferences = profile_data.get('preferences', {})
     
     phases = {1: "втягивающая", 2: "ударная", 3: "ударная", 4: "восстановительная"}
     phase = phases.get(week_num, "втягивающая")
     macrocycle_info = f"Это {week_num}-я неделя 4-недельного макроцикла. Фаза: {phase}. Учти это при составлении плана."
+    if history_context:
+        macrocycle_info += f"\n\n**Сводка предыдущих недель (сохраняй преемственность объема и нагрузки):**\n{history_context}"
 
     prompt = f"""
 Проанализируй данные о спортсмене и создай для него персонализированный план на 7 дней.
@@ -359,34 +381,39 @@ async def process_additional_info(message: Message, state: FSMContext):
     telegram_id = message.from_user.id
     await message.answer("Спасибо! Сохраняю твой профиль...")
     
-    user = await asyncio.to_thread(get_user_by_telegram_id, telegram_id)
-    if user:
-        user_db_id = user['id']
-        success = await asyncio.to_thread(save_onboarding_data, user_db_id, user_data)
-        
-        if success:
-            await message.answer("Отлично! Профиль сохранен. Генерирую твой первый план. Это может занять до минуты...", parse_mode=None)
+    # Сохранение профиля, генерация и сохранение плана должны завершиться и при остановке бота
+    with track_inflight():
+        user = await asyncio.to_thread(get_user_by_telegram_id, telegram_id)
+        if user:
+            user_db_id = user['id']
+            success = await asyncio.to_thread(save_onboarding_data, user_db_id, user_data)
             
-            full_profile = await asyncio.to_thread(get_full_user_profile, user_db_id)
-            if full_profile:
-                prompt = format_prompt_for_detailed_json(full_profile)
+            if success:
+                await message.answer("Отлично! Профиль сохранен. Генерирую твой первый план. Это может занять до минуты...", parse_mode=None)
                 
-                plan_json = await generate_structured_plan_with_llm(prompt)
-                
-                if "error" not in plan_json:
-                    formatted_plan = format_detailed_plan_for_user(plan_json)
-                    await message.answer(formatted_plan, parse_mode=ParseMode.MARKDOWN, reply_markup=get_plan_feedback_keyboard())
-                    await state.update_data(last_generated_plan=plan_json)
-                    today = date.today().isoformat()
-                    await asyncio.to_thread(save_generated_plan, user_db_id, today, plan_json)
+                full_profile = await asyncio.to_thread(get_full_user_profile, user_db_id)
+                if full_profile:
+                    history = await asyncio.to_thread(get_training_history, user_db_id)
+                    # План на сегодняшнюю дату будет перезаписан, поэтому не передаем его как предыдущую неделю
+                    history_context = history.to_prompt_block(exclude=date.today().isoformat())
+                    prompt = format_prompt_for_detailed_json(full_profile, history_context=history_context)
+                    
+                    plan_json = await generate_structured_plan_with_llm(prompt)
+                    
+                    if "error" not in plan_json:
+                        formatted_plan = format_detailed_plan_for_user(plan_json)
+                        await message.answer(formatted_plan, parse_mode=ParseMode.MARKDOWN, reply_markup=get_plan_feedback_keyboard())
+                        await state.update_data(last_generated_plan=plan_json)
+                        today = date.today().isoformat()
+                        await asyncio.to_thread(save_generated_plan, user_db_id, today, plan_json)
+                    else:
+                        await message.answer(f"Ошибка генерации плана: {plan_json['error']}")
                 else:
-                    await message.answer(f"Ошибка генерации плана: {plan_json['error']}")
+                    await message.answer("Не удалось получить данные твоего профиля для генерации плана.")
             else:
-                await message.answer("Не удалось получить данные твоего профиля для генерации плана.")
+                await message.answer("Произошла ошибка при сохранении профиля.")
         else:
-            await message.answer("Произошла ошибка при сохранении профиля.")
-    else:
-        await message.answer("Не смог найти твой профиль для сохранения.")
+            await message.answer("Не смог найти твой профиль для сохранения.")
     await state.set_state(None)
 
 async def navigate_back(callback: CallbackQuery, state: FSMContext):
@@ -439,13 +466,14 @@ async def process_plan_changes(message: Message, state: FSMContext):
 
 Пожалуйста, перегенерируй полный план в том же формате JSON, но с учетом этих правок. Убедись, что новый ответ также содержит все ключи: intro_summary, training_plan, workout_details, meal_plan, shopping_list, general_recommendations.
 """
-    plan_json = await generate_structured_plan_with_llm(edit_prompt)
-    if "error" not in plan_json:
-        formatted_plan = format_detailed_plan_for_user(plan_json)
-        await message.answer(formatted_plan, parse_mode=ParseMode.MARKDOWN, reply_markup=get_plan_feedback_keyboard())
-        await state.update_data(last_generated_plan=plan_json)
-    else:
-        await message.answer(f"Ошибка генерации плана: {plan_json['error']}")
+    with track_inflight():
+        plan_json = await generate_structured_plan_with_llm(edit_prompt)
+        if "error" not in plan_json:
+            formatted_plan = format_detailed_plan_for_user(plan_json)
+            await message.answer(formatted_plan, parse_mode=ParseMode.MARKDOWN, reply_markup=get_plan_feedback_keyboard())
+            await state.update_data(last_generated_plan=plan_json)
+        else:
+            await message.answer(f"Ошибка генерации плана: {plan_json['error']}")
     
     await state.set_state(None)
 
@@ -453,7 +481,33 @@ async def set_main_menu(bot: Bot):
     main_menu_commands = [
         BotCommand(command="/start", description="Начать знакомство / Обновить профиль")
     ]
-    await bot.set_my_commands(main_menu_commands)
+    try:
+        await bot.set_my_commands(main_menu_commands)
+    except Exception as e:
+        logging.error(f"Не удалось установить меню команд: {e}")
+
+async def on_startup():
+    """Вызывается диспетчером непосредственно перед началом поллинга."""
+    if READY_FILE:
+        with open(READY_FILE, "w") as f:
+            f.write(str(os.getpid()))
+    logging.info(f"Бот готов принимать обновления за {time.perf_counter() - started_at:.2f} с")
+
+async def drain_inflight(timeout: float):
+    """Ждет завершения генераций и сохранений планов, но не дольше timeout секунд."""
+    pending = {task for task in inflight_tasks if not task.done()}
+    if not pending:
+        return
+    logging.warning(f"Ожидание завершения генераций в процессе: {len(pending)} (не дольше {timeout:.0f} с)...")
+    done, pending = await asyncio.wait(pending, timeout=timeout)
+    if pending:
+        logging.error(f"Не дождались завершения генераций: {len(pending)}, прерываем их.")
+        # Отменяем и дожидаемся отмены до закрытия клиентов, чтобы задачи не обращались к ним после закрытия
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    else:
+        logging.info(f"Все генерации завершены ({len(done)}).")
 
 def register_handlers(dp: Dispatcher):
     dp.message.register(command_start, F.text.startswith("/start"))
@@ -487,27 +541,38 @@ def register_handlers(dp: Dispatcher):
     dp.message.register(process_plan_changes, EditingState.waiting_for_changes)
 
 async def main():
-    logging.info("--- Запуск бота ---")
+    logging.info(f"--- Запуск бота --- (модули загружены за {time.perf_counter() - started_at:.2f} с)")
+    # Маркер мог остаться от аварийно завершенного процесса — не сообщаем о готовности раньше времени
+    if READY_FILE and os.path.exists(READY_FILE):
+        os.remove(READY_FILE)
     
     register_handlers(dp)
-    await set_main_menu(bot)
+    dp.startup.register(on_startup)
+    
+    # Меню команд не нужно для обработки обновлений, поэтому не задерживаем им старт
+    menu_task = asyncio.create_task(set_main_menu(bot))
     
     try:
         logging.info("Удаление вебхука и очистка старых обновлений...")
+        webhook_started_at = time.perf_counter()
+        # drop_pending_updates уже отбрасывает накопившиеся обновления, отдельные get_updates не нужны
         await bot.delete_webhook(drop_pending_updates=True)
-        
-        updates = await bot.get_updates(offset=-1, limit=1)
-        if updates:
-            update_id = updates[-1].update_id + 1
-            logging.info(f"Пропускаем обновления до ID: {update_id}")
-            await bot.get_updates(offset=update_id)
+        logging.info(f"Вебхук удален за {time.perf_counter() - webhook_started_at:.2f} с")
         
         logging.info("Запуск поллинга...")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        # По SIGTERM/SIGINT aiogram прекращает прием новых обновлений и возвращает управление сюда;
+        # сессию бота закрываем сами, после того как дождемся генераций в процессе
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types(), close_bot_session=False)
 
     except Exception as e:
         logging.critical(f"Критическая ошибка при запуске бота: {e}", exc_info=True)
     finally:
+        if READY_FILE and os.path.exists(READY_FILE):
+            os.remove(READY_FILE)
+        await drain_inflight(SHUTDOWN_DRAIN_TIMEOUT)
+        if not menu_task.done():
+            menu_task.cancel()
+        await close_llm_client()
         await bot.session.close()
         logging.warning("Сессия бота закрыта.")
 
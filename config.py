@@ -7,3 +7,7 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+# Сколько секунд ждать завершения генераций планов при остановке (SIGTERM)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "25"))
+# Необязательный путь к файлу-маркеру готовности (для health check при деплое)
+READY_FILE = os.getenv("READY_FILE")
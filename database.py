@@ -1,5 +1,6 @@
 import logging
-from typing import Optional, Dict, Any
+import threading
+from typing import Optional, Dict, Any, List
 
 # Импортируем create_client из официальной библиотеки supabase
 from supabase import create_client 
@@ -11,13 +12,25 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
     raise ValueError("Supabase URL and Service Key must be set.")
 
-# Создаем СИНХРОННЫЙ клиент
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+# СИНХРОННЫЙ клиент создается лениво, при первом обращении к БД, а не при импорте модуля
+# (функции вызываются через asyncio.to_thread, поэтому инициализация защищена блокировкой)
+_supabase = None
+_supabase_lock = threading.Lock()
+
+def get_supabase():
+    """Возвращает клиент Supabase, создавая его при первом вызове."""
+    global _supabase
+    if _supabase is None:
+        with _supabase_lock:
+            if _supabase is None:
+                _supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+                logging.info("Supabase client initialized.")
+    return _supabase
 
 def get_user_by_telegram_id(telegram_id: int) -> Optional[dict]:
     """Находит пользователя по его telegram_id и возвращает его запись из таблицы users."""
     try:
-        response = supabase.table('users').select('id, status').eq('telegram_id', telegram_id).limit(1).execute()
+        response = get_supabase().table('users').select('id, status').eq('telegram_id', telegram_id).limit(1).execute()
         if response.data:
             return response.data[0]
         return None
@@ -32,7 +45,7 @@ def insert_user(telegram_id: int, tg_name: str) -> Optional[dict]:
         if existing_user:
             return existing_user
         insert_data = { "telegram_id": telegram_id, "tg_name": tg_name, "status": "onboarding" }
-        insert_response = supabase.table('users').insert(insert_data).execute()
+        insert_response = get_supabase().table('users').insert(insert_data).execute()
         if insert_response.data:
             return insert_response.data[0]
         return None
@@ -64,7 +77,7 @@ def save_onboarding_data(user_id: str, data: Dict[str, Any]) -> bool:
             "long_run_day": data.get("long_run_day")
         }
 
-        supabase.rpc('upsert_user_onboarding_data', {
+        get_supabase().rpc('upsert_user_onboarding_data', {
             'p_user_id': user_id,
             'p_profile_data': profile_data,
             'p_preferences_data': preferences_data
@@ -80,7 +93,7 @@ def save_onboarding_data(user_id: str, data: Dict[str, Any]) -> bool:
 def get_full_user_profile(user_id: str) -> Optional[dict]:
     """Собирает полную информацию о пользователе из таблиц user_profile и training_preferences."""
     try:
-        response = supabase.rpc('get_user_complete_profile', {'p_user_id': user_id}).execute()
+        response = get_supabase().rpc('get_user_complete_profile', {'p_user_id': user_id}).execute()
         
         if response.data:
             logging.info(f"Successfully fetched full profile for user_id: {user_id}")
@@ -100,7 +113,7 @@ def save_generated_plan(user_id: str, week_start_date: str, plan_data: dict) ->
         workout_details = plan_data.get("workout_details")
         if training_plan:
             full_training_details = {"schedule": training_plan, "details": workout_details}
-            supabase.table('training_plans').upsert({"user_id": user_id, "week_start_date": week_start_date, "plan_details": full_training_details}, on_conflict="user_id,week_start_date").execute()
+            get_supabase().table('training_plans').upsert({"user_id": user_id, "week_start_date": week_start_date, "plan_details": full_training_details}, on_conflict="user_id,week_start_date").execute()
             logging.info(f"Saved training plan for user {user_id}")
 
         meal_plan = plan_data.get("meal_plan")
@@ -113,10 +126,22 @@ def save_generated_plan(user_id: str, week_start_date: str, plan_data: dict) ->
                     for item in category.get('items', []):
                         shopping_list_str += f"- {item}\n"
 
-            supabase.table('meal_plans').upsert({"user_id": user_id, "week_start_date": week_start_date, "plan_details": meal_plan, "shopping_list": shopping_list_str}, on_conflict="user_id,week_start_date").execute()
+            get_supabase().table('meal_plans').upsert({"user_id": user_id, "week_start_date": week_start_date, "plan_details": meal_plan, "shopping_list": shopping_list_str}, on_conflict="user_id,week_start_date").execute()
             logging.info(f"Saved meal plan for user {user_id}")
         
         return True
     except Exception as e:
         logging.error(f"An error occurred in save_generated_plan for user {user_id}: {e}")
         return False
+
+def get_training_plans_since(user_id: str, since_date: Optional[str] = None) -> List[dict]:
+    """Возвращает сохраненные недельные планы тренировок пользователя (начиная с since_date включительно), отсортированные по дате."""
+    try:
+        query = get_supabase().table('training_plans').select('week_start_date, plan_details').eq('user_id', user_id)
+        if since_date:
+            query = query.gte('week_start_date', since_date)
+        response = query.order('week_start_date').execute()
+        return response.data or []
+    except Exception as e:
+        logging.error(f"An error occurred in get_training_plans_since for user {user_id}: {e}")
+        return []
@@ -0,0 +1,162 @@
+import logging
+import re
+import threading
+from datetime import date, timedelta
+from typing import Optional, List, Dict, Any
+
+from database import get_training_plans_since
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Сколько последних недель описывать подробно; более ранние сворачиваются в одну итоговую строку,
+# поэтому размер блока в промпте не растет вместе с историей пользователя
+RECENT_WEEKS = 4
+MAX_KEY_SESSIONS = 3
+MAX_TEXT_LEN = 60
+
+# Отрезок дистанции: "8 км", "5×1 км", "6x400 м"; темп вида "6:00/км" не совпадает
+DISTANCE_PATTERN = re.compile(r'(?:(\d+)\s*[×xх*]\s*)?(\d+(?:[.,]\d+)?)\s*(км|м)(?![а-яё])', re.IGNORECASE)
+TOTAL_PATTERN = re.compile(r'(?:всего|итого)[:\s]*(\d+(?:[.,]\d+)?)\s*км', re.IGNORECASE)
+KEY_SESSION_WORDS = ("интервал", "темп", "фартлек", "повтор", "отрезк", "горк", "пано")
+LONG_RUN_WORDS = ("длительн",)
+
+# Кэш сводок по пользователям: user_id -> состояние истории
+_cache: Dict[str, "TrainingHistory"] = {}
+_cache_lock = threading.Lock()
+
+def _shorten(text: str) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= MAX_TEXT_LEN else text[:MAX_TEXT_LEN - 1] + "…"
+
+def _workout_km(details: Any) -> float:
+    """Оценивает дистанцию тренировки в км по текстовому описанию: суммирует отрезки с учетом повторов."""
+    if not isinstance(details, str):
+        return 0.0
+    # Явно указанный итог ("всего 10 км") точнее суммы отрезков
+    total = TOTAL_PATTERN.search(details)
+    if total:
+        return float(total.group(1).replace(',', '.'))
+    # "10 км, из них 3 км в темпе" — отрезки после "из них" уже входят в общую дистанцию
+    details = details.split("из них")[0]
+    km = 0.0
+    for reps, value, unit in DISTANCE_PATTERN.findall(details):
+        distance = float(value.replace(',', '.')) * (int(reps) if reps else 1)
+        km += distance if unit.lower() == 'км' else distance / 1000
+    return km
+
+def _week_of(value: Optional[str]) -> Optional[str]:
+    """Возвращает дату понедельника ISO-недели, в которую попадает дата value."""
+    try:
+        day = date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return value
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+def summarize_week(row: dict) -> dict:
+    """Сворачивает один сохраненный недельный план в компактную сводку."""
+    # План сгенерирован LLM, поэтому структуру не считаем гарантированной
+    plan_details = row.get("plan_details")
+    if not isinstance(plan_details, dict):
+        plan_details = {}
+    schedule = plan_details.get("schedule")
+    if not isinstance(schedule, list):
+        schedule = []
+
+    weekly_km = 0.0
+    long_run_km = 0.0
+    max_run_km = 0.0
+    key_sessions = []
+    for day in schedule:
+        if not isinstance(day, dict):
+            continue
+        for slot in ("morning_workout", "evening_workout"):
+            workout = day.get(slot)
+            if not isinstance(workout, dict):
+                continue
+            workout_type = str(workout.get("type") or "")
+            km = _workout_km(workout.get("details"))
+            weekly_km += km
+            max_run_km = max(max_run_km, km)
+
+            type_lower = workout_type.lower()
+            if any(word in type_lower for word in LONG_RUN_WORDS):
+                long_run_km = max(long_run_km, km)
+            elif any(word in type_lower for word in KEY_SESSION_WORDS) and len(key_sessions) < MAX_KEY_SESSIONS:
+                key_sessions.append(_shorten(f"{workout_type}: {workout.get('details')}"))
+
+    # Если длительная явно не помечена, считаем ею самую длинную пробежку недели
+    if not long_run_km:
+        long_run_km = max_run_km
+
+    feedback = plan_details.get("feedback") or plan_details.get("adherence")
+    return {
+        "week_start_date": row.get("week_start_date"),
+        # Планы сохраняются по дате генерации, а не по тренировочной неделе, поэтому группируем по ISO-неделе
+        "week": _week_of(row.get("week_start_date")),
+        "weekly_km": round(weekly_km, 1),
+        "long_run_km": round(long_run_km, 1),
+        "key_sessions": key_sessions,
+        "feedback": _shorten(feedback) if feedback else None,
+    }
+
+class TrainingHistory:
+    """Инкрементально накапливаемая сводка истории тренировок одного пользователя."""
+
+    def __init__(self):
+        self.recent: List[dict] = []
+        self.older_weeks = 0
+        self.older_total_km = 0.0
+        self.older_max_long_run_km = 0.0
+        self.last_week_start: Optional[str] = None
+        self.lock = threading.Lock()
+
+    @property
+    def weeks_count(self) -> int:
+        return self.older_weeks + len(self.recent)
+
+    def add(self, summary: dict):
+        # План из той же ISO-недели (повторный /start) заменяет предыдущий: строки приходят по возрастанию даты
+        if self.recent and self.recent[-1]["week"] == summary["week"]:
+            self.recent[-1] = summary
+        else:
+            self.recent.append(summary)
+        self.last_week_start = summary["week_start_date"]
+
+        while len(self.recent) > RECENT_WEEKS:
+            old = self.recent.pop(0)
+            self.older_weeks += 1
+            self.older_total_km += old["weekly_km"]
+            self.older_max_long_run_km = max(self.older_max_long_run_km, old["long_run_km"])
+
+    def to_prompt_block(self, exclude: Optional[str] = None) -> str:
+        """Формирует блок фиксированного размера для вставки в промпт, пропуская неделю, в которую попадает дата exclude."""
+        exclude_week = _week_of(exclude) if exclude else None
+        lines = []
+        if self.older_weeks:
+            avg_km = self.older_total_km / self.older_weeks
+            lines.append(
+                f"- Ранее: {self.older_weeks} нед., в среднем ~{avg_km:.1f} км/нед., самая длинная пробежка ~{self.older_max_long_run_km:.1f} км"
+            )
+        for week in self.recent:
+            if week["week"] == exclude_week:
+                continue
+            line = f"- Неделя с {week['week']}: ~{week['weekly_km']:.1f} км, длительная ~{week['long_run_km']:.1f} км"
+            if week["key_sessions"]:
+                line += "; ключевые: " + "; ".join(week["key_sessions"])
+            if week["feedback"]:
+                line += f"; отзыв: {week['feedback']}"
+            lines.append(line)
+        return "\n".join(lines)
+
+def get_training_history(user_id: str) -> TrainingHistory:
+    """Возвращает закэшированную сводку истории пользователя, догружая из БД только новые недели."""
+    with _cache_lock:
+        history = _cache.setdefault(user_id, TrainingHistory())
+    with history.lock:
+        # Последний план запрашиваем повторно: он мог быть перегенерирован
+        weeks_before = history.weeks_count
+        for row in get_training_plans_since(user_id, history.last_week_start):
+            history.add(summarize_week(row))
+        if history.weeks_count != weeks_before:
+            logging.info(f"Training history for user {user_id} updated: {history.weeks_count} week(s)")
+        return history
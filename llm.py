@@ -12,6 +12,28 @@ headers = {
     "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
 }
 
+# Общий HTTP-клиент создается лениво при первой генерации и переиспользует соединения
+_client = None
+_client_closed = False
+
+def get_llm_client() -> httpx.AsyncClient:
+    """Возвращает общий httpx-клиент для запросов к LLM, создавая его при первом вызове."""
+    global _client
+    if _client_closed:
+        # После начала остановки новый клиент уже некому закрыть
+        raise RuntimeError("LLM client is closed: shutdown in progress.")
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=90.0)
+    return _client
+
+async def close_llm_client():
+    """Закрывает общий httpx-клиент, если он был создан; после этого новые запросы к LLM не выполняются."""
+    global _client, _client_closed
+    _client_closed = True
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+
 async def generate_structured_plan_with_llm(prompt: str) -> dict:
     if not DEEPSEEK_API_KEY:
         logging.error("DEEPSEEK_API_KEY is not set!")
@@ -27,17 +49,17 @@ async def generate_structured_plan_with_llm(prompt: str) -> dict:
     }
 
     try:
-        async with httpx.AsyncClient(timeout=90.0) as client:
-            response = await client.post(DEEPSEEK_API_URL, headers=headers, json=payload)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if data.get("choices") and len(data["choices"]) > 0:
-                content_str = data["choices"][0]["message"]["content"]
-                return json.loads(content_str)
-            else:
-                return {"error": "Не удалось получить ответ от нейросети."}
+        client = get_llm_client()
+        response = await client.post(DEEPSEEK_API_URL, headers=headers, json=payload)
+        response.raise_for_status()
+        
+        data = response.json()
+        
+        if data.get("choices") and len(data["choices"]) > 0:
+            content_str = data["choices"][0]["message"]["content"]
+            return json.loads(content_str)
+        else:
+            return {"error": "Не удалось получить ответ от нейросети."}
     except Exception as e:
         logging.error(f"An unexpected error in generate_plan_with_llm: {e}")
         return {"error": "Произошла непредвиденная ошибка."}